@@ -2,15 +2,24 @@
 import asyncio
 import json
 import os
+import re
+import stat
 import sys
 import logging
-from typing import List, Dict, Any, Optional, Tuple, Mapping, Set
+from types import MappingProxyType
+from typing import List, Dict, Any, Optional, Tuple, Mapping, Set, Awaitable, Callable, Iterable
 from dataclasses import dataclass, field
 from dotenv import load_dotenv
 import base64
 from datetime import datetime
 import aiohttp
 import contextlib # Added for managing multiple async contexts
+import functools
+
+try:
+    import orjson  # Optional: faster parsing for character and MCP config files
+except ImportError:
+    orjson = None
 
 # load .env file
 load_dotenv()
@@ -31,7 +40,7 @@ from src.carrier.utils.logging import configure_logging
 # Import the renamed runtime
 from src.carrier.runtime.agent_runtime import AgentRuntime # Updated import
 # Import tools and tool registry functionality
-from src.carrier.tools import get_registered_tools
+from src.carrier.tools import get_registered_tools, close_http_session
 
 # Configure logging
 logger = configure_logging()
@@ -44,26 +53,49 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 
 # --- Configuration Loading ---
 
-async def load_json_file(file_path: str) -> Dict[str, Any]:
-    """Load and parse a JSON file asynchronously."""
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"File not found: {file_path}")
-    
-    # In a real async scenario, you might use aiofiles, but for config, sync is often fine.
-    # Using sync here for simplicity as it's typically done at startup.
+def _read_json(file_path: str) -> Dict[str, Any]:
+    """Read and parse a JSON file from disk, using orjson when it is installed."""
     try:
+        if orjson is not None:
+            # orjson parses the raw bytes directly, skipping the text decode step
+            with open(file_path, 'rb') as f:
+                return orjson.loads(f.read())
         with open(file_path, 'r', encoding='utf-8') as f:
             return json.load(f)
-    except json.JSONDecodeError as e:
+    except json.JSONDecodeError as e: # orjson.JSONDecodeError is a subclass
         logger.error(f"Error decoding JSON from {file_path}: {e}")
         raise
     except Exception as e:
         logger.error(f"Error loading file {file_path}: {e}")
         raise
 
+def _stat_version(file_path: str) -> Tuple[int, int]:
+    """Return (mtime_ns, size) for a file, used to key the character caches.
+
+    The size catches rewrites that land within the filesystem's mtime granularity.
+    """
+    try:
+        st = os.stat(file_path)
+        return st.st_mtime_ns, st.st_size
+    except FileNotFoundError:
+        raise FileNotFoundError(f"File not found: {file_path}")
+
+async def load_json_file(file_path: str) -> Dict[str, Any]:
+    """Load and parse a JSON file asynchronously."""
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"File not found: {file_path}")
+    
+    # Read and parse in a worker thread so the event loop keeps serving clients
+    return await asyncio.to_thread(_read_json, file_path)
+
+@functools.lru_cache(maxsize=32)
+def _load_char_cached(file_path: str, version: Tuple[int, int]) -> Dict[str, Any]:
+    """Parse a character file once per (path, mtime, size); editing the file invalidates the entry."""
+    return _read_json(file_path)
+
 async def load_character_file(file_path: str) -> Dict[str, Any]:
-    """Load and parse the character file"""
-    return await load_json_file(file_path)
+    """Load and parse the character file, reusing the parsed data while the file is unchanged"""
+    return await asyncio.to_thread(_load_char_cached, file_path, _stat_version(file_path))
 
 async def load_mcp_server_configs(file_path: str = "config/mcp_servers.json") -> Dict[str, Any]:
     """Load MCP server configurations."""
@@ -71,6 +103,34 @@ async def load_mcp_server_configs(file_path: str = "config/mcp_servers.json") ->
     config_data = await load_json_file(file_path)
     return config_data.get("mcpServers", {})
 
+# MCP server env values written as YOUR_<NAME>_HERE are filled from the environment variable <NAME>
+_PLACEHOLDER_RE = re.compile(r'^YOUR_(.+)_HERE$')
+
+def _resolve_placeholder_env(configs: Iterable[Dict[str, Any]]) -> Mapping[str, str]:
+    """Resolve every env placeholder used by the given MCP server configs in one pass.
+
+    Returns a read-only map from variable name to value for the variables that are set.
+    Each missing variable is warned about once, however many servers reference it.
+    """
+    names = {
+        match.group(1)
+        for config in configs
+        for value in config.get("env", {}).values()
+        if isinstance(value, str) and (match := _PLACEHOLDER_RE.match(value))
+    }
+    resolved: Dict[str, str] = {}
+    for name in sorted(names):
+        value = os.environ.get(name)
+        if value:
+            resolved[name] = value
+        else:
+            # Keep the placeholder to avoid crashing if the key is optional for the server
+            logger.warning(f"Environment variable {name} not found for MCP servers. Placeholder 'YOUR_{name}_HERE' will be used.")
+    return MappingProxyType(resolved)
+
+# Config keys copied straight into MCPServerStdio params; env is resolved separately
+_STDIO_PARAM_KEYS = ("command", "args", "cwd")
+
 # --- Tool Management ---
 
 def get_available_tools(tool_config: List[str]) -> Tuple[List[Tool], Dict[str, str]]:
@@ -81,62 +141,100 @@ def get_available_tools(tool_config: List[str]) -> Tuple[List[Tool], Dict[str, s
 
 # --- System Prompt Building ---
 
-def build_system_prompt(character_data: Dict[str, Any], client: str = "generic", all_tool_descriptions: Dict[str, str] = None) -> str:
-    """Build a comprehensive system prompt from character data, including all tools."""
+# Static prompt blocks, built once at import so every agent gets byte-identical text.
+# The client context is sent as its own system message (see build_client_context) so that
+# the long character prompt stays identical across clients and provider prompt caches hit.
+_CLIENT_CONTEXT_HEADER = "## Client Context\n"
+_CLIENT_CONTEXT = {
+    "discord": (
+        _CLIENT_CONTEXT_HEADER
+        + "- You are interacting in a Discord server.\n"
+        "- You'll only respond when someone mentions you by name or tags you.\n"
+        "- Keep responses appropriately sized for a chat client.\n"
+        "- Remember that many people might be watching this conversation.\n"
+    ),
+    "instagram": (
+        _CLIENT_CONTEXT_HEADER
+        + "- You are interacting on Instagram via direct messages.\n"
+        # ... (rest of instagram context)
+    ),
+}
+_TOOLS_HEADER = "\n\n## Available Tools\n"
+_NO_TOOLS_BLOCK = _TOOLS_HEADER + "- You don't have any tools available to use.\n"
+_TOOLS_INTRO = _TOOLS_HEADER + "You have access to the following tools:\n"
+_TOOLS_FOOTER = "\nUse the LIST_AVAILABLE_TOOLS tool if you need to see this list again."
+
+def build_client_context(client: str = "generic") -> str:
+    """Build the short client-specific context message that accompanies each run."""
+    client_context = _CLIENT_CONTEXT.get(client)
+    if client_context is None:
+        client_context = f"{_CLIENT_CONTEXT_HEADER}- You are interacting via a {client} client.\n"
+    return client_context
+
+def build_system_prompt(character_data: Dict[str, Any], all_tool_descriptions: Dict[str, str] = None) -> str:
+    """Build a comprehensive, client-independent system prompt from character data, including all tools."""
     
-    system_prompt = character_data.get("system", "")
+    parts: List[str] = [character_data.get("system", "")]
     
     # Add bio, lore, style, examples (existing logic remains the same)
     bio = character_data.get("bio", [])
     if bio:
-        system_prompt += "\n\n## About You\n" + "\n".join([f"- {item}" for item in bio])
+        parts.append("\n\n## About You\n")
+        parts.append("\n".join([f"- {item}" for item in bio]))
     lore = character_data.get("lore", [])
     if lore:
-        system_prompt += "\n\n## Your Background\n" + "\n".join([f"- {item}" for item in lore])
+        parts.append("\n\n## Your Background\n")
+        parts.append("\n".join([f"- {item}" for item in lore]))
     style = character_data.get("style", {})
     all_style = style.get("all", [])
     chat_style = style.get("chat", [])
     if all_style or chat_style:
-        system_prompt += "\n\n## Your Communication Style\n"
-        if all_style: system_prompt += "\n".join([f"- {item}" for item in all_style])
-        if chat_style: system_prompt += "\n" + "\n".join([f"- {item}" for item in chat_style])
+        parts.append("\n\n## Your Communication Style\n")
+        if all_style: parts.append("\n".join([f"- {item}" for item in all_style]))
+        if chat_style: parts.extend(("\n", "\n".join([f"- {item}" for item in chat_style])))
     examples = character_data.get("messageExamples", [])
     if examples and len(examples) > 0:
-        system_prompt += "\n\n## Example Conversations\n"
+        parts.append("\n\n## Example Conversations\n")
+        agent_name = character_data.get("name")
         for i, example in enumerate(examples[:3]):
-            system_prompt += f"\nExample {i+1}:\n"
+            parts.append(f"\nExample {i+1}:\n")
             for message in example:
-                role = "User" if message.get("user") != character_data.get("name") else character_data.get("name")
-                content = message.get("content", {}).get("text", "")
-                system_prompt += f"{role}: {content}\n"
-
-    # Add client context (existing logic remains the same)
-    system_prompt += "\n\n## Client Context\n"
-    if client == "discord":
-        system_prompt += "- You are interacting in a Discord server.\n"
-        system_prompt += "- You'll only respond when someone mentions you by name or tags you.\n"
-        system_prompt += "- Keep responses appropriately sized for a chat client.\n"
-        system_prompt += "- Remember that many people might be watching this conversation.\n"
-    elif client == "instagram":
-        system_prompt += "- You are interacting on Instagram via direct messages.\n"
-        # ... (rest of instagram context)
-    else:
-         system_prompt += f"- You are interacting via a {client} client.\n"
+                role = agent_name if message.get("user") == agent_name else "User"
+                message_content = message.get("content")
+                content = message_content.get("text", "") if message_content else ""
+                parts.append(f"{role}: {content}\n")
 
     # Updated section for ALL available tools (built-in + MCP)
-    system_prompt += "\n\n## Available Tools\n"
     if not all_tool_descriptions or len(all_tool_descriptions) == 0:
-        system_prompt += "- You don't have any tools available to use.\n"
+        parts.append(_NO_TOOLS_BLOCK)
     else:
-        system_prompt += "You have access to the following tools:\n"
-        # Sort tools alphabetically for consistency
-        for tool_name in sorted(all_tool_descriptions.keys()):
-            description = all_tool_descriptions[tool_name]
-            # Ensure tool name is uppercase for clarity in the prompt
-            system_prompt += f"- {tool_name.upper()}: {description}\n"
-        system_prompt += "\nUse the LIST_AVAILABLE_TOOLS tool if you need to see this list again."
-
-    return system_prompt
+        parts.append(_TOOLS_INTRO)
+        # Sort tools alphabetically for consistency; names are already uppercased when collected
+        for tool_name, description in sorted(all_tool_descriptions.items()):
+            parts.append(f"- {tool_name}: {description}\n")
+        parts.append(_TOOLS_FOOTER)
+
+    # Join once at the end rather than growing a string with repeated +=
+    return "".join(parts)
+
+@functools.lru_cache(maxsize=32)
+def _build_prompt_memo(canonical_character: str, tool_descriptions: Tuple[Tuple[str, str], ...]) -> str:
+    """Build the system prompt for one canonical character JSON and tool set, memoized in process."""
+    return build_system_prompt(json.loads(canonical_character), dict(tool_descriptions))
+
+def _build_prompt_cached(
+    character_data: Dict[str, Any],
+    tool_descriptions: Tuple[Tuple[str, str], ...]
+) -> str:
+    """Build the system prompt once per (character data, tools) combination.
+
+    The memo is keyed on the character data itself, so the prompt always matches the data
+    the agent is built from, even if the file has changed since it was read. Returning the
+    same string object for repeated initializations also keeps the prompt byte-identical
+    across agents, which lets provider-side prompt caching hit.
+    """
+    canonical = json.dumps(character_data, sort_keys=True, ensure_ascii=False, default=str)
+    return _build_prompt_memo(canonical, tool_descriptions)
 
 # --- Agent Initialization ---
 
@@ -145,13 +243,17 @@ async def initialize_agent(
     character_file: str,
     client: str = "generic",
     active_mcp_servers: Optional[List[MCPServer]] = None,
-    context: Optional[Any] = None # Added context parameter
+    context: Optional[Any] = None, # Added context parameter
+    mcp_tool_cache: Optional[Dict[MCPServer, Any]] = None,
+    character_data: Optional[Dict[str, Any]] = None
 ) -> Tuple[CarrierAgent, AgentMemory, Optional[AgentRuntime]]: # Updated return type hint
     
     """Initialize a Carrier agent from character file, including MCP tools."""
     logger.info(f"Initializing agent from {character_file} for {client}")
     
-    character_data = await load_character_file(character_file)
+    # The prompt is built from this same data, so both stay consistent even if the file changes
+    if character_data is None:
+        character_data = await load_character_file(character_file)
     agent_name = character_data.get("name", "Agent")
 
     # 1. Get built-in tools
@@ -162,76 +264,68 @@ async def initialize_agent(
     mcp_tool_descriptions: Dict[str, str] = {}
     if active_mcp_servers:
         logger.info(f"Fetching tools from {len(active_mcp_servers)} active MCP server(s) for {agent_name}")
-        for server in active_mcp_servers:
+        # The SDK's list_tools returns a list of MCPTool objects; reuse the lists fetched at
+        # startup when given, otherwise list every server at once
+        if mcp_tool_cache is not None:
+            results = [mcp_tool_cache.get(server, []) for server in active_mcp_servers]
+        else:
+            results = await asyncio.gather(
+                *(server.list_tools() for server in active_mcp_servers), return_exceptions=True
+            )
+        for server, tools_list in zip(active_mcp_servers, results):
             server_name_log = getattr(server, 'name', f"Unnamed {server.__class__.__name__}")
-            try:
-                logger.debug(f"Fetching tools from MCP server: {server_name_log}")
-                
-                # The SDK's list_tools returns a list of MCPTool objects
+            if isinstance(tools_list, BaseException):
+                logger.error(f"Error listing tools from MCP server {server_name_log}: {tools_list}")
+                continue
+            if not tools_list:
+                logger.debug(f"No tools found for MCP server: {server_name_log}")
+                continue
+            logger.info(f"MCP server {server_name_log} has {len(tools_list)} tools")
+
+            # Add server reference to each tool
+            for tool in tools_list:
+                # Attach the server reference to each tool
+                tool.server = server
+
+            # Extract tool information for display purposes
+            for tool in tools_list:
                 try:
-                    tools_list = await server.list_tools()
-                    if not tools_list:
-                        logger.debug(f"No tools found for MCP server: {server_name_log}")
+                    # Access tool properties safely with getattr for resilience
+                    tool_name = getattr(tool, 'name', None)
+                    if not tool_name:
+                        logger.warning(f"Found tool without name from {server_name_log}, skipping")
                         continue
-                        
-                    # Add server reference to each tool
-                    for tool in tools_list:
-                        # Attach the server reference to each tool
-                        tool.server = server
-                        
-                    # Extract tool information for display purposes
-                    for tool in tools_list:
-                        try:
-                            # Access tool properties safely with getattr for resilience
-                            tool_name = getattr(tool, 'name', None)
-                            if not tool_name:
-                                logger.warning(f"Found tool without name from {server_name_log}, skipping")
-                                continue
-                                
-                            description = getattr(tool, 'description', "No description provided.")
-                            
-                            # Store the tool information for system prompt
-                            mcp_tool_descriptions[tool_name.upper()] = description
-                            logger.debug(f"Found MCP tool '{tool_name}' from server '{server_name_log}'")
-                        except Exception as tool_e:
-                            logger.error(f"Error processing tool from {server_name_log}: {tool_e}")
-                except Exception as list_e:
-                    logger.error(f"Error listing tools from MCP server {server_name_log}: {list_e}")
-            except Exception as e:
-                logger.error(f"Failed to interact with MCP server '{server_name_log}': {e}", exc_info=True)
+
+                    description = getattr(tool, 'description', "No description provided.")
+
+                    # Store the tool information for system prompt
+                    mcp_tool_descriptions[tool_name.upper()] = description
+                    logger.debug(f"Found MCP tool '{tool_name}' from server '{server_name_log}'")
+                except Exception as tool_e:
+                    logger.error(f"Error processing tool from {server_name_log}: {tool_e}")
 
     # 3. Combine tools and descriptions
     # The Agent constructor expects Tool objects for built-in, schemas (dicts) for MCP are handled internally via mcp_servers param
     all_tools_for_prompt = {**built_in_tool_descriptions, **mcp_tool_descriptions}
     
     # 4. Build system prompt with all tools
-    system_prompt = build_system_prompt(character_data, client, all_tools_for_prompt)
+    system_prompt = _build_prompt_cached(character_data, tuple(sorted(all_tools_for_prompt.items())))
     
     # 5. Initialize the standard OpenAI Agent, passing MCP servers
     # Note: The 'tools' parameter here should only contain the *built-in* Tool objects.
     # The SDK handles MCP tool availability via the 'mcp_servers' parameter.
     
     # Make sure all tools are valid Tool objects from the agents package
-    validated_tools = []
-    
-    for i, tool in enumerate(built_in_tools):
-        if isinstance(tool, Tool):
-            validated_tools.append(tool)
-            logger.debug(f"Valid built-in tool {i}: {tool.name} - Type: {type(tool).__name__}")
-        else:
-            logger.warning(f"Skipping invalid tool {getattr(tool, 'name', f'unknown_{i}')} - Type: {type(tool).__name__}")
-    
-    # Validate MCP servers
-    validated_mcp_servers = []
-    for server in (active_mcp_servers or []):
-        if hasattr(server, 'list_tools') and callable(server.list_tools):
-            validated_mcp_servers.append(server)
-            logger.debug(f"Valid MCP server: {getattr(server, 'name', 'Unnamed')}")
-        else:
-            logger.warning(f"Skipping invalid MCP server: {getattr(server, 'name', f'Unnamed')} - Missing required methods")
-    
+    validated_tools = [tool for tool in built_in_tools if isinstance(tool, Tool)]
+    if len(validated_tools) != len(built_in_tools):
+        dropped = [getattr(tool, 'name', type(tool).__name__) for tool in built_in_tools if not isinstance(tool, Tool)]
+        logger.warning("Skipping invalid tools: %s", dropped)
+
+    # MCP servers come from the started MCPServerStdio/MCPServerSse instances, so they need no re-validation
+    agent_mcp_servers = active_mcp_servers or []
+
     # Log summary of available tools
-    logger.info(f"Initializing agent with {len(validated_tools)} built-in tools and {len(validated_mcp_servers)} MCP servers")
+    logger.info(f"Initializing agent with {len(validated_tools)} built-in tools and {len(agent_mcp_servers)} MCP servers")
     
     # Create the base agent with validated components
     base_agent = Agent(
@@ -239,7 +333,7 @@ async def initialize_agent(
         instructions=system_prompt,
         model=character_data.get("model", "gpt-4o"),
         tools=validated_tools,
-        mcp_servers=validated_mcp_servers
+        mcp_servers=agent_mcp_servers
     )
     
     # 6. Initialize memory
@@ -248,20 +342,16 @@ async def initialize_agent(
     # 7. Convert to CarrierAgent and store combined tool info
     agent = CarrierAgent.from_agent(base_agent, memory)
     agent.all_tool_descriptions = all_tools_for_prompt # Store for potential use by LIST_AVAILABLE_TOOLS
-
-    # Log combined tools
-    tools_log_list = sorted(all_tools_for_prompt.keys())
-    logger.info(f"{agent.name} initialized for {client} with tools: {', '.join(tools_log_list) if tools_log_list else 'NO TOOLS'}")
+    # One agent serves every client of the character; each client sends its own context per run,
+    # outside the cached instructions
+    client_names = {client, *(name.lower() for name in character_data.get("clients", []))}
+    agent.client_contexts = {name: build_client_context(name) for name in client_names}
+
+    # Log combined tools; only sort and join the names when the line will actually be emitted
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("%s initialized for %s with tools: %s", agent.name, client,
+                    ", ".join(sorted(all_tools_for_prompt)) or "NO TOOLS")
     
-    # Add this to initialize_agent function before creating the base agent
-    for server in validated_mcp_servers:
-        # Test if the server can list tools
-        try:
-            tools = await server.list_tools()
-            logger.info(f"MCP server {getattr(server, 'name', 'Unknown')} has {len(tools)} tools")
-        except Exception as e:
-            logger.error(f"Error listing tools from MCP server {getattr(server, 'name', 'Unknown')}: {e}")
-
     # Then after creating the base agent
     # Test if MCP tools can be retrieved from the agent
     # try:
@@ -278,7 +368,7 @@ async def initialize_agent(
     goals = character_data.get("goals", []) # Assuming goals are directly in character_data
     if goals:
         # Find the NocoDB MCP server instance from the validated active list
-        nocodb_mcp = next((srv for srv in validated_mcp_servers if getattr(srv, 'name', None) == 'nocodb'), None) # Use lowercase 'nocodb' based on config keys
+        nocodb_mcp = next((srv for srv in agent_mcp_servers if getattr(srv, 'name', None) == 'nocodb'), None) # Use lowercase 'nocodb' based on config keys
 
         if nocodb_mcp:
             try:
@@ -318,6 +408,129 @@ async def initialize_agent(
 
 async def main():
     """Main function to run agent clients based on character configuration"""
+    # Python 3.12+: tasks run their synchronous prefix immediately instead of waiting for a
+    # loop iteration, and gather() over already-finished tasks completes without scheduling
+    if hasattr(asyncio, "eager_task_factory"):
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+    
+    try:
+        await run_agents()
+    finally:
+        # Release pooled HTTP connections held by the tools, even on error or cancellation
+        await close_http_session()
+
+
+# Environment variable suffixes holding each character's client credentials ({username}{suffix})
+DISCORD_TOKEN_SUFFIX = "_DISCORD_API_TOKEN"
+INSTAGRAM_TOKEN_SUFFIX = "_INSTAGRAM_ACCESS_TOKEN"
+
+
+async def _run_client(run: Awaitable[Any], close: Callable[[], Awaitable[Any]]) -> None:
+    """Run a client's main coroutine and always let the client shut down, even when cancelled."""
+    try:
+        await run
+    finally:
+        await close()
+
+
+async def _setup_character(
+    char_file: str,
+    character_data: Dict[str, Any],
+    active_mcp_servers_map: Dict[str, MCPServer],
+    client_tokens: Mapping[str, str],
+    mcp_tool_cache: Optional[Dict[MCPServer, Any]] = None
+) -> List[asyncio.Task]:
+    """Initialize one character's agent and start its clients and runtime, returning their tasks."""
+    tasks: List[asyncio.Task] = []
+    agent_name_log = character_data.get("name", char_file) # Use agent name for logging
+    username = character_data.get("username")
+    # Normalize once so "Discord" and "discord" in the character file both match
+    supported_clients = frozenset(name.lower() for name in character_data.get("clients", []))
+    required_servers_for_agent = character_data.get("mcp_servers", [])
+    
+    # Get the active server instances needed by this agent
+    agent_mcp_instances: List[MCPServer] = []
+    missing: List[str] = []
+    for name in required_servers_for_agent:
+        server = active_mcp_servers_map.get(name)
+        if server is None:
+            missing.append(name)
+        else:
+            agent_mcp_instances.append(server)
+    if missing:
+        logger.warning(f"Agent {agent_name_log} requires MCP servers that failed to start or are not configured: {missing}")
+
+    # Create a placeholder context for this agent run if needed
+    # In a real app, this might load user data, session info, etc.
+    agent_context = {"user_id": f"{agent_name_log}_user", "session_id": f"{agent_name_log}_session"} # Example context
+
+    # Initialize agent and potentially the runtime ONCE per character file
+    agent, memory, agent_runtime = await initialize_agent(
+        char_file,
+        client="discord" if "discord" in supported_clients else "generic", # Primary client label for memory; contexts cover all clients
+        active_mcp_servers=agent_mcp_instances,
+        context=agent_context, # Pass the context
+        mcp_tool_cache=mcp_tool_cache,
+        character_data=character_data # Already parsed in the first pass
+    )
+
+    # Initialize clients for this agent, using the SAME agent instance
+    if "discord" in supported_clients:
+        discord_token = client_tokens.get(f"{username}{DISCORD_TOKEN_SUFFIX}")
+        if discord_token:
+            discord_client = DiscordAgentClient(agent, memory) # Use already initialized agent/memory
+            discord_config = character_data.get("discord_config", {})
+            discord_client.initial_channel = discord_config.get("initial_channel")
+            discord_client.initial_message = discord_config.get("initial_message")
+            tasks.append(asyncio.create_task(_run_client(discord_client.start(discord_token), discord_client.close)))
+        else:
+            logger.error(f"Missing Discord token for {username}")
+
+    if "instagram" in supported_clients:
+        instagram_token = client_tokens.get(f"{username}{INSTAGRAM_TOKEN_SUFFIX}")
+        if instagram_token:
+            # Use the SAME agent instance initialized above
+            instagram_client = InstagramAgentClient(agent, memory) # Re-use agent/memory
+            tasks.append(asyncio.create_task(_run_client(instagram_client.run(instagram_token), instagram_client.stop)))
+        else:
+            logger.error(f"Missing Instagram token for {username}")
+
+    # Add other client initializations here...
+
+    # Start Agent Runtime ONCE per agent if initialized
+    if agent_runtime:
+        logger.info(f"Starting AgentRuntime for {agent.name}")
+        tasks.append(asyncio.create_task(agent_runtime.run_continuously()))
+
+    return tasks
+
+
+def _describe_path(path: str) -> str:
+    """Summarize a path's state from a single stat call (plus one access check when it exists)."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return f"{path} (exists: False)"
+    return f"{path} (exists: True, directory: {stat.S_ISDIR(st.st_mode)}, writable: {os.access(path, os.W_OK)})"
+
+
+def _diagnose_filesystem_server(server_name: str, config: Dict[str, Any]) -> None:
+    """Log a filesystem MCP server's resolved command, environment, and paths."""
+    env_vars = config.get("env", {})
+    logger.debug(f"Filesystem MCP server '{server_name}' configuration:")
+    logger.debug(f"  Command: {config.get('command', '')} {' '.join(config.get('args', []))}")
+    logger.debug(f"  CWD: {config.get('cwd', 'Not specified')}")
+    logger.debug(f"  Environment variables: {env_vars}")
+    logger.debug(f"  Workspace path: {_describe_path(os.path.abspath('mcp_workspace'))}")
+
+    allowed_paths = env_vars.get('ALLOWED_PATHS')
+    logger.debug(f"  ALLOWED_PATHS: {allowed_paths or 'Not specified'}")
+    if allowed_paths:
+        logger.debug(f"  Normalized allowed path: {_describe_path(os.path.normpath(allowed_paths))}")
+
+
+async def run_agents():
+    """Start the MCP servers, agents, clients, and runtimes and run until they finish"""
     load_dotenv()
     
     character_files = [
@@ -327,220 +540,151 @@ async def main():
         # Add other character files here
     ]
     
-    mcp_server_configs = await load_mcp_server_configs()
     required_mcp_server_names: Set[str] = set()
     agent_configs = {}
 
-    # First pass: Load all character configs and identify unique required MCP servers
+    # First pass: Load all character configs and identify unique required MCP servers.
+    # The reads run in worker threads, so load the server configs and every character file together
     logger.info("Identifying required MCP servers across all agents...")
-    for char_file in character_files:
-        try:
-            character_data = await load_character_file(char_file)
-            agent_configs[char_file] = character_data # Store config for later use
-            mcp_names = character_data.get("mcp_servers", [])
-            required_mcp_server_names.update(mcp_names)
-            logger.debug(f"Agent {character_data.get('name')} requires MCP servers: {mcp_names}")
-        except Exception as e:
-            logger.error(f"Error loading character file {char_file}: {e}")
+    mcp_server_configs, *loaded = await asyncio.gather(
+        load_mcp_server_configs(),
+        *(load_character_file(char_file) for char_file in character_files),
+        return_exceptions=True
+    )
+    if isinstance(mcp_server_configs, BaseException):
+        raise mcp_server_configs
+    for char_file, character_data in zip(character_files, loaded):
+        if isinstance(character_data, BaseException):
+            logger.error(f"Error loading character file {char_file}: {character_data}")
+            continue
+        agent_configs[char_file] = character_data # Store config for later use
+        mcp_names = character_data.get("mcp_servers", [])
+        required_mcp_server_names.update(mcp_names)
+        logger.debug(f"Agent {character_data.get('name')} requires MCP servers: {mcp_names}")
             
     logger.info(f"Unique MCP servers required: {required_mcp_server_names or 'None'}")
 
-    client_tasks = []
     active_mcp_servers_map: Dict[str, MCPServer] = {}
 
     # Wrap the main execution block with tracing
     with trace("Carrier Agent Run"):
-        # Use AsyncExitStack to manage MCP server lifecycles
+        # Use AsyncExitStack to manage MCP server lifecycles; everything that uses the
+        # servers runs inside this block so they stay up until the clients finish
         async with contextlib.AsyncExitStack() as stack:
             # Start all required MCP servers concurrently
             startup_tasks = []
+            resolved_env = _resolve_placeholder_env(
+                mcp_server_configs[name] for name in required_mcp_server_names if name in mcp_server_configs
+            )
             for server_name in required_mcp_server_names:
-                if server_name in mcp_server_configs: # Correct indentation
-                    config = mcp_server_configs[server_name]
-                    server_type = config.get("type")
-                    display_name = config.get("name", server_name) # Use provided name or key
-                cache_tools = config.get("cache_tools_list", False)
+                if server_name not in mcp_server_configs:
+                    logger.warning(f"Configuration not found for required MCP server: {server_name}")
+                    continue
+
+                config = mcp_server_configs[server_name]
+                server_type = config.get("type")
+                display_name = config.get("name", server_name) # Use provided name or key
+                cache_tools = config.get("cache_tools_list", True)
                 
                 server_instance = None
-                params = {}
-
-                # Prepare environment variables, loading from os.getenv if placeholder exists
-                server_env = config.get("env", {}).copy()
-                for key, value in server_env.items():
-                    if isinstance(value, str) and value.startswith("YOUR_") and value.endswith("_HERE"):
-                         # Attempt to load from environment variables
-                         env_var_name = value.replace("YOUR_", "").replace("_HERE", "")
-                         env_value = os.getenv(env_var_name)
-                         if env_value:
-                              server_env[key] = env_value
-                              logger.debug(f"Loaded env var {env_var_name} for MCP server {server_name}")
-                         else:
-                              logger.warning(f"Environment variable {env_var_name} not found for MCP server {server_name}. Placeholder '{value}' will be used.")
-                              # Keep the placeholder or handle as error depending on requirements
-                              # For now, keep placeholder to avoid crashing if key is optional for server
-                              # server_env[key] = "" # Or raise error
-
-                # For filesystem server, add additional checks
-                if server_name == "filesystem" or "filesystem" in server_name:
-                    workspace_path = os.path.abspath("mcp_workspace")
-                    logger.info(f"Filesystem MCP server workspace path: {workspace_path}")
-                    logger.info(f"Path exists: {os.path.exists(workspace_path)}")
-                    logger.info(f"Path is writable: {os.access(workspace_path, os.W_OK)}")
-                    
-                    # Check environment variables
-                    config_env = config.get("env", {})
-                    logger.info(f"Filesystem MCP server environment: {config_env}")
-                    
-                    # Log the full resolved command
-                    cmd = config.get("command", "")
-                    args = config.get("args", [])
-                    logger.info(f"Filesystem MCP command: {cmd} {' '.join(args)}")
+
+                # Prepare environment variables, filling placeholders from the resolved environment
+                server_env = {}
+                for key, value in config.get("env", {}).items():
+                    match = _PLACEHOLDER_RE.match(value) if isinstance(value, str) else None
+                    server_env[key] = resolved_env.get(match.group(1), value) if match else value
+
+                # For filesystem servers, make sure the allowed directory exists before the server starts
+                if "filesystem" in server_name.lower():
+                    if logger.isEnabledFor(logging.DEBUG):
+                        _diagnose_filesystem_server(server_name, config)
+                    allowed_paths = config.get("env", {}).get("ALLOWED_PATHS")
+                    if allowed_paths:
+                        try:
+                            os.makedirs(os.path.normpath(allowed_paths), exist_ok=True)
+                        except Exception as e:
+                            logger.error(f"Failed to create directory {allowed_paths} for MCP server {server_name}: {e}")
 
                 if server_type == "stdio":
-                    params = {
-                        "command": config.get("command"),
-                        "args": config.get("args", []),
-                        "cwd": config.get("cwd"),
-                        "env": server_env,
-                    }
+                    params = {key: config.get(key, [] if key == "args" else None) for key in _STDIO_PARAM_KEYS}
+                    params["env"] = server_env
                     if not params["command"]:
                          logger.error(f"Missing 'command' for stdio MCP server: {server_name}")
-                         continue # Correct indentation
+                         continue
                     server_instance = MCPServerStdio(name=display_name, params=params, cache_tools_list=cache_tools)
                 elif server_type == "sse":
                     url = config.get("url")
                     headers = config.get("headers") # Headers might contain auth tokens
                     if not url:
                          logger.error(f"Missing 'url' for sse MCP server: {server_name}")
-                         continue # Correct indentation
+                         continue
                     # Note: MCPServerSse doesn't explicitly take env, but headers can be used for tokens
                     server_instance = MCPServerSse(name=display_name, url=url, headers=headers, cache_tools_list=cache_tools)
                 else:
                     logger.error(f"Unsupported MCP server type '{server_type}' for server: {server_name}")
-                    continue # Correct indentation
+                    continue
 
                 if server_instance:
                     logger.info(f"Attempting to start MCP server: {server_name} ({display_name})")
                     # Use stack.enter_async_context to manage the server's lifecycle
                     startup_tasks.append( (server_name, stack.enter_async_context(server_instance)) )
 
-            else:
-                logger.warning(f"Configuration not found for required MCP server: {server_name}")
-
-        # Wait for all servers to start (or fail)
-        try:
-            started_servers = await asyncio.gather(*(task for _, task in startup_tasks))
+            # Wait for all servers to start (or fail); one failing server doesn't discard the others
+            started_servers = await asyncio.gather(*(task for _, task in startup_tasks), return_exceptions=True)
             # Populate the map of active servers
-            for i, (server_name, _) in enumerate(startup_tasks):
-                 active_mcp_servers_map[server_name] = started_servers[i]
-                 logger.info(f"MCP server '{server_name}' started successfully.")
-        except Exception as e:
-            logger.error(f"Error starting one or more MCP servers: {e}", exc_info=True)
-            # Depending on requirements, might want to exit or continue without failed servers
+            for (server_name, _), result in zip(startup_tasks, started_servers):
+                if isinstance(result, BaseException):
+                    logger.error(f"Error starting MCP server '{server_name}': {result}", exc_info=result)
+                    continue
+                active_mcp_servers_map[server_name] = result
+                logger.info(f"MCP server '{server_name}' started successfully.")
 
             logger.info(f"Active MCP servers: {list(active_mcp_servers_map.keys())}")
             logger.info("-------------------- Finished loading MCP servers --------------------")
 
-            # Inside the main function, before starting MCP servers
-        for server_name in required_mcp_server_names:
-            if server_name in mcp_server_configs:
-                config = mcp_server_configs[server_name]
-                if "filesystem" in server_name.lower():
-                    logger.info(f"Filesystem MCP server configuration:")
-                    logger.info(f"  Command: {config.get('command')}")
-                    logger.info(f"  Args: {config.get('args')}")
-                    logger.info(f"  CWD: {config.get('cwd', 'Not specified')}")
-                    logger.info(f"  Environment variables: {config.get('env', {})}")
-                    
-                    # Check if ALLOWED_PATHS is properly set
-                    env_vars = config.get('env', {})
-                    allowed_paths = env_vars.get('ALLOWED_PATHS', 'Not specified')
-                    logger.info(f"  ALLOWED_PATHS: {allowed_paths}")
-                    
-                    # Make sure the directory exists
-                    if allowed_paths != 'Not specified':
-                        # Convert to normalized path
-                        normalized_path = os.path.normpath(allowed_paths)
-                        logger.info(f"  Normalized allowed path: {normalized_path}")
-                        logger.info(f"  Path exists: {os.path.exists(normalized_path)}")
-                        logger.info(f"  Path is directory: {os.path.isdir(normalized_path)}")
-                        logger.info(f"  Path is writable: {os.access(normalized_path, os.W_OK)}")
-                        
-                        # Create the directory if it doesn't exist
-                        if not os.path.exists(normalized_path):
-                            try:
-                                os.makedirs(normalized_path, exist_ok=True)
-                                logger.info(f"  Created directory: {normalized_path}")
-                            except Exception as e:
-                                logger.error(f"  Failed to create directory: {e}")
-
-            # Second pass: Initialize agents, clients, and runtimes using the active servers
+            # List each server's tools once; every agent that uses the server reads from this cache
+            active_servers = list(active_mcp_servers_map.values())
+            mcp_tool_cache: Dict[MCPServer, Any] = dict(zip(
+                active_servers,
+                await asyncio.gather(*(server.list_tools() for server in active_servers), return_exceptions=True)
+            ))
+
+            # Second pass: Initialize agents, clients, and runtimes using the active servers.
+            # Characters are independent, so set them up concurrently; one failing doesn't stop the rest
             logger.info("Initializing agents, clients, and runtimes...")
+            # Bind the environment once for all characters. Lookups go through os.environ itself
+            # rather than a filtered copy so Windows keeps its case-insensitive variable names
+            client_tokens = os.environ
+            results = await asyncio.gather(
+                *(_setup_character(char_file, character_data, active_mcp_servers_map, client_tokens, mcp_tool_cache)
+                  for char_file, character_data in agent_configs.items()),
+                return_exceptions=True
+            )
             all_tasks = [] # Collect all client and runtime tasks here
-            for char_file, character_data in agent_configs.items():
-                try: # Correct alignment with 'for' loop
-                    agent_name_log = character_data.get("name", char_file) # Use agent name for logging
-                    username = character_data.get("username")
-                    supported_clients = character_data.get("clients", [])
-                    required_servers_for_agent = character_data.get("mcp_servers", []) # Correct indentation
-                    
-                    # Get the active server instances needed by this agent
-                    agent_mcp_instances = [active_mcp_servers_map[name] for name in required_servers_for_agent if name in active_mcp_servers_map]
-                    if len(agent_mcp_instances) != len(required_servers_for_agent):
-                        missing = set(required_servers_for_agent) - set(active_mcp_servers_map.keys())
-                        logger.warning(f"Agent {agent_name_log} requires MCP servers that failed to start or are not configured: {missing}")
-
-                    # Create a placeholder context for this agent run if needed
-                    # In a real app, this might load user data, session info, etc.
-                    agent_context = {"user_id": f"{agent_name_log}_user", "session_id": f"{agent_name_log}_session"} # Example context
-
-                    # Initialize agent and potentially the runtime ONCE per character file
-                    agent, memory, agent_runtime = await initialize_agent( # Renamed variable
-                        char_file,
-                        client="discord" if "Discord" in supported_clients else "generic", # Determine primary client type for prompt?
-                        active_mcp_servers=agent_mcp_instances,
-                        context=agent_context # Pass the context
-                    )
-
-                    # Initialize clients for this agent, using the SAME agent instance
-                    if "Discord" in supported_clients: # Correct indentation
-                        discord_token = os.getenv(f"{username}_DISCORD_API_TOKEN")
-                        if discord_token:
-                            discord_client = DiscordAgentClient(agent, memory) # Use already initialized agent/memory
-                            discord_config = character_data.get("discord_config", {})
-                            discord_client.initial_channel = discord_config.get("initial_channel")
-                            discord_client.initial_message = discord_config.get("initial_message")
-                            all_tasks.append(asyncio.create_task(discord_client.start(discord_token)))
-                        else:
-                            logger.error(f"Missing Discord token for {username}")
-
-                    if "Instagram" in supported_clients: # Correct indentation
-                        instagram_token = os.getenv(f"{username}_INSTAGRAM_ACCESS_TOKEN")
-                        if instagram_token:
-                            # Use the SAME agent instance initialized above
-                            instagram_client = InstagramAgentClient(agent, memory) # Re-use agent/memory
-                            all_tasks.append(asyncio.create_task(instagram_client.run(instagram_token)))
-                        else:
-                            logger.error(f"Missing Instagram token for {username}")
-
-                    # Add other client initializations here...
-
-                    # Start Agent Runtime ONCE per agent if initialized # Correct indentation & comment
-                    if agent_runtime: # Renamed variable
-                        logger.info(f"Starting AgentRuntime for {agent.name}") # Updated log
-                        runtime_task = asyncio.create_task(agent_runtime.run_continuously()) # Renamed variable
-                        all_tasks.append(runtime_task)
-
-                except Exception as e: # Correct alignment with 'try'
-                    logger.error(f"Error initializing agent/client/runtime from {char_file}: {e}", exc_info=True)
-
-            # Keep the main task running while client and runtime tasks are active # Correct alignment with 'for' loop
+            for char_file, result in zip(agent_configs, results):
+                if isinstance(result, BaseException):
+                    logger.error(f"Error initializing agent/client/runtime from {char_file}: {result}", exc_info=result)
+                else:
+                    all_tasks.extend(result)
+
+            # Keep the main task running while client and runtime tasks are active
             if all_tasks:
                 logger.info("-------------------------------- Agents Starting --------------------------------")
                 logger.info(f"Running {len(all_tasks)} task(s) (clients and runtimes)...")
-                await asyncio.gather(*all_tasks)
-        else:
-            logger.error("No clients or runtimes were successfully initialized to run.")
+                try:
+                    # Return as soon as any task fails rather than leaving the rest running unobserved
+                    done, _ = await asyncio.wait(all_tasks, return_when=asyncio.FIRST_EXCEPTION)
+                    for task in done:
+                        if not task.cancelled() and task.exception() is not None:
+                            logger.error(f"Task {task.get_name()} failed: {task.exception()}", exc_info=task.exception())
+                finally:
+                    # Cancel whatever is still running (including on Ctrl-C) and wait for every
+                    # client to finish shutting down before the MCP servers are closed
+                    for task in all_tasks:
+                        task.cancel()
+                    await asyncio.gather(*all_tasks, return_exceptions=True)
+            else:
+                logger.error("No clients or runtimes were successfully initialized to run.")
 
     logger.info("All MCP servers shut down.") # This should be outside the trace block
 
@@ -6,22 +6,33 @@ interacting with Discord using the discord.py library.
 """
 
 import os
+import asyncio
 import logging
 import re
+import weakref
 from typing import Dict, Tuple, List, Any
 import discord
 from discord.ext import commands
-from datetime import datetime
 
 from agents import Agent, Runner, RunContextWrapper, RunHooks
 
 from ..utils.logging import configure_logging
 from ..utils.hooks_util import add_memory_hooks
-from ..extensions.carrier_agent import AgentMemory
+from ..hooks.memory_hooks import history_to_input_items
+from ..extensions.carrier_agent import AgentMemory, MessageContext
 
 # Configure logging
 logger = configure_logging()
 
+# Number of prior messages replayed to the agent with each new message
+CONVERSATION_LIMIT = 10
+
+# Maximum number of agent turns processed at once across all channels
+MAX_CONCURRENT_TURNS = 16
+
+# Sent immediately when a message is picked up, then edited into the agent's reply
+THINKING_PLACEHOLDER = "…"
+
 class DiscordHooks(RunHooks):
     """Discord-specific hooks for the agent runtime"""
 
@@ -35,42 +46,16 @@ class DiscordHooks(RunHooks):
 
     async def on_tool_start(self, context: RunContextWrapper, agent: Agent, tool: Any) -> None:
         """Called when a tool execution begins"""
-        logger.info(f"[{self.client}] Executing tool: {tool.name}")
+        logger.info("[%s] Executing tool: %s", self.client, tool.name)
 
     async def on_tool_end(self, context: RunContextWrapper, agent: Agent, tool: Any, result: str) -> None:
         """Called when a tool execution completes"""
-        logger.info(f"[{self.client}] Tool {tool.name} completed.")
+        logger.info("[%s] Tool %s completed.", self.client, tool.name)
 
     async def on_agent_end(self, context: RunContextWrapper, agent: Agent, output: Any) -> None:
         """Called when agent processing completes"""
-        memory = self._get_memory_from_context(context)
-        
-        # Store conversation in memory for future context
-        if memory and hasattr(output, 'content') and output.content:
-            memory.conversation_history.append({
-                "role": "assistant",
-                "content": output.content,
-                "timestamp": "now",  # In a real implementation, use actual timestamp
-                "client": self.client
-            })
-            logger.info(f"[{self.client}] Memory contains {len(memory.conversation_history)} messages")
-        
-        logger.info(f"[{self.client}] Response generated and stored in memory")
-    
-    def _get_memory_from_context(self, context: RunContextWrapper) -> AgentMemory:
-        """Get memory object from context if available."""
-        if not context or not context.context:
-            return None
-            
-        # If context is directly a memory object
-        if isinstance(context.context, AgentMemory):
-            return context.context
-            
-        # If context has a memory attribute
-        if hasattr(context.context, 'memory'):
-            return context.context.memory
-            
-        return None
+        # The reply is stored in memory, tagged with its room, by MemoryContextHooks
+        logger.info("[%s] Response generated", self.client)
 
 
 def get_hooks_with_memory(agent: Agent, user_id: str, room_id: str) -> RunHooks:
@@ -89,7 +74,6 @@ def get_hooks_with_memory(agent: Agent, user_id: str, room_id: str) -> RunHooks:
         agent=agent,
         user_id=user_id,
         room_id=room_id,
-        conversation_limit=10,
         client_name="Discord"
     )
 
@@ -111,6 +95,13 @@ class DiscordAgentClient(discord.Client):
         self.agent = agent
         self.memory = memory
         
+        # Case-insensitive matcher for the agent's name, compiled once instead of
+        # lowercasing the name and every message body on each incoming message
+        self._name_re = re.compile(re.escape(agent.name), re.IGNORECASE)
+        # Matcher for this bot's own mention (<@id> and nickname form <@!id>); built on first
+        # use because self.user is only known once connected (see _get_self_mention_re)
+        self._self_mention_re = None
+        
         # Client configuration
         self.initial_channel = None  # Can be set to send initial message on startup
         self.initial_message = None  # Message to send on startup
@@ -118,6 +109,12 @@ class DiscordAgentClient(discord.Client):
         
         # Client state
         self.ready = False
+        
+        # discord.py runs each on_message in its own task. The per-channel lock keeps replies
+        # in arrival order (asyncio locks are FIFO) while the semaphore bounds total LLM turns.
+        # Locks are held weakly, so a channel's lock is dropped once no turn holds or awaits it
+        self._channel_locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self._turn_semaphore = asyncio.Semaphore(MAX_CONCURRENT_TURNS)
     
     async def on_ready(self):
         """Called when the bot is ready and connected to Discord"""
@@ -134,55 +131,107 @@ class DiscordAgentClient(discord.Client):
             except Exception as e:
                 logger.error(f"Error sending initial message: {e}")
     
+    def _get_self_mention_re(self) -> "re.Pattern[str]":
+        """Return the matcher for this bot's mention, compiling it on first use.
+
+        discord.py can deliver messages before on_ready fires (self.user is set at READY,
+        while on_ready waits for guild chunking), so this can't be built in on_ready.
+        """
+        if self._self_mention_re is None:
+            self._self_mention_re = re.compile(rf"<@!?{self.user.id}>")
+        return self._self_mention_re
+
     async def on_message(self, message):
         """Called when a message is received"""
         # Ignore own messages
         if message.author == self.user:
             return
             
-        # Check if the bot was mentioned or addressed by name
-        bot_mentioned = self.user.mentioned_in(message)
-        name_mentioned = self.agent.name.lower() in message.content.lower()
-        
-        # Only respond to mentions or direct messages
-        if bot_mentioned or name_mentioned or isinstance(message.channel, discord.DMChannel):
-            await self.process_agent_message(message)
+        # Only respond to direct messages, mentions, or messages addressing the agent by name.
+        # Cheapest checks first: most messages are neither, and `or` stops at the first hit
+        if (
+            isinstance(message.channel, discord.DMChannel)
+            or self.user.mentioned_in(message)
+            or self._name_re.search(message.content) is not None
+        ):
+            # Acknowledge right away, before waiting on the channel lock or a free turn
+            # slot, so queued messages are not left without a response; the placeholder
+            # is edited with the reply once the turn finishes
+            try:
+                placeholder = await message.channel.send(THINKING_PLACEHOLDER)
+            except discord.HTTPException as e:
+                logger.warning(f"Could not send placeholder: {e}")
+                placeholder = None
+            channel_lock = self._channel_locks.get(message.channel.id)
+            if channel_lock is None:
+                channel_lock = self._channel_locks[message.channel.id] = asyncio.Lock()
+            async with channel_lock, self._turn_semaphore:
+                await self.process_agent_message(message, placeholder)
     
-    async def process_agent_message(self, message):
-        """Process a message with the agent"""
+    async def _send_reply(self, message, placeholder, content):
+        """Replace the placeholder with content, or send it as a new message if that fails."""
+        if placeholder is not None:
+            try:
+                await placeholder.edit(content=content)
+                return
+            except discord.HTTPException as e:
+                logger.warning(f"Could not edit placeholder: {e}")
+        await message.channel.send(content)
+    
+    async def process_agent_message(self, message, placeholder=None):
+        """Process a message with the agent, replacing placeholder (if any) with the reply"""
         try:
             # Prepare message content
             content = message.content
             
             # Remove bot mention or name from content
-            if f"<@{self.user.id}>" in content:
-                content = content.replace(f"<@{self.user.id}>", "").strip()
-            elif self.agent.name.lower() in content.lower():
-                content = content.replace(self.agent.name, "", flags=re.IGNORECASE).strip()
+            content, mention_count = self._get_self_mention_re().subn("", content)
+            if mention_count:
+                content = content.strip()
+            elif self._name_re.search(content):
+                content = self._name_re.sub("", content).strip()
             
             # Set typing indicator
             async with message.channel.typing():
+                # Replay prior turns as run input, then add the new message. The
+                # client context travels as its own system message so the agent's
+                # instructions stay byte-identical and provider prompt caching can hit
+                room_id = str(message.channel.id)
+                input_items = history_to_input_items(
+                    self.memory.conversation_history, CONVERSATION_LIMIT, room_id=room_id
+                )
+                input_items.append({"role": "user", "content": content})
+                client_context = getattr(self.agent, 'client_contexts', {}).get("discord")
+                if client_context:
+                    input_items.insert(0, {"role": "system", "content": client_context})
+                
                 # Store user message in memory
                 self.memory.conversation_history.append({
                     "role": "user",
                     "content": content,
                     "timestamp": str(message.created_at),
                     "client": "discord",
-                    "user_id": str(message.author.id)
+                    "user_id": str(message.author.id),
+                    "room_id": room_id
                 })
                 
                 # Create hooks with memory context
                 hooks = get_hooks_with_memory(
                     agent=self.agent,
                     user_id=str(message.author.id),
-                    room_id=str(message.channel.id)
+                    room_id=room_id
                 )
                 
                 # Process message with agent
                 result = await Runner.run(
                     starting_agent=self.agent,
-                    input=content,
-                    context=self.memory,
+                    input=input_items,
+                    context=MessageContext(
+                        memory=self.memory,
+                        user_id=str(message.author.id),
+                        room_id=room_id,
+                        client="discord"
+                    ),
                     hooks=hooks
                 )
                 
@@ -191,9 +240,9 @@ class DiscordAgentClient(discord.Client):
                 
                 # Send response in chunks if needed (Discord has a 2000 character limit)
                 if len(response) <= 2000:
-                    await message.channel.send(response)
+                    await self._send_reply(message, placeholder, response)
                 else:
-                    # Split response into chunks
+                    # Split response into chunks; the first replaces the placeholder
                     chunks = [response[i:i+1990] for i in range(0, len(response), 1990)]
                     for i, chunk in enumerate(chunks):
                         # Add continuation indicator
@@ -201,11 +250,13 @@ class DiscordAgentClient(discord.Client):
                             chunk += "... (continued)"
                         if i > 0:
                             chunk = "... " + chunk
-                        await message.channel.send(chunk)
+                            await message.channel.send(chunk)
+                        else:
+                            await self._send_reply(message, placeholder, chunk)
         
         except Exception as e:
             logger.error(f"Error processing message: {e}")
-            await message.channel.send(f"I encountered an error: {str(e)}")
+            await self._send_reply(message, placeholder, f"I encountered an error: {str(e)}")
     
     async def start(self, token, *args, **kwargs):
         """Start the Discord client with the provided token"""
@@ -9,10 +9,11 @@ import os
 import asyncio
 import json
 import logging
+import random
 from typing import Dict, Tuple, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
 import aiohttp
 from ftplib import FTP
-from datetime import datetime
 
 from agents import Agent, Runner, RunContextWrapper, RunHooks
 
@@ -26,6 +27,10 @@ logger = configure_logging()
 # base url for instagram api
 BASE_URL = "https://graph.instagram.com"
 
+# File extensions post_media recognizes (matched case-insensitively)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+VIDEO_EXTENSIONS = ('.mp4', '.mov')
+
 class InstagramHooks(RunHooks):
     """Instagram-specific hooks for the agent runtime"""
     
@@ -39,42 +44,16 @@ class InstagramHooks(RunHooks):
     
     async def on_tool_start(self, context: RunContextWrapper, agent: Agent, tool: Any) -> None:
         """Called when a tool execution begins"""
-        logger.info(f"[{self.client}] Executing tool: {tool.name}")
+        logger.info("[%s] Executing tool: %s", self.client, tool.name)
     
     async def on_tool_end(self, context: RunContextWrapper, agent: Agent, tool: Any, result: str) -> None:
         """Called when a tool execution completes"""
-        logger.info(f"[{self.client}] Tool {tool.name} completed with result: {result}")
+        logger.info("[%s] Tool %s completed with result: %s", self.client, tool.name, result)
     
     async def on_agent_end(self, context: RunContextWrapper, agent: Agent, output: Any) -> None:
         """Called when agent processing completes"""
-        memory = self._get_memory_from_context(context)
-        
-        # Store conversation in memory for future context
-        if memory and hasattr(output, 'content') and output.content:
-            memory.conversation_history.append({
-                "role": "assistant",
-                "content": output.content,
-                "timestamp": "now",  # In a real implementation, use actual timestamp
-                "client": self.client
-            })
-            logger.info(f"[{self.client}] Memory contains {len(memory.conversation_history)} messages")
-        
-        logger.info(f"[{self.client}] Response generated and stored in memory")
-    
-    def _get_memory_from_context(self, context: RunContextWrapper) -> Optional[AgentMemory]:
-        """Get memory object from context if available."""
-        if not context or not context.context:
-            return None
-            
-        # If context is directly a memory object
-        if isinstance(context.context, AgentMemory):
-            return context.context
-            
-        # If context has a memory attribute
-        if hasattr(context.context, 'memory'):
-            return context.context.memory
-            
-        return None
+        # The reply is stored in memory, tagged with its room, by MemoryContextHooks
+        logger.info("[%s] Response generated", self.client)
 
 
 def get_hooks_with_memory(agent: Agent, user_id: str, room_id: str) -> RunHooks:
@@ -93,7 +72,6 @@ def get_hooks_with_memory(agent: Agent, user_id: str, room_id: str) -> RunHooks:
         agent=agent,
         user_id=user_id,
         room_id=room_id,
-        conversation_limit=10,
         client_name="Instagram"
     )
 
@@ -116,6 +94,19 @@ class InstagramAgentClient:
         # Client state
         self.is_running = False
         self.post_count = 0
+        
+        # Polling configuration
+        self.polling_interval = 60  # Seconds between activity checks (respects API rate limits)
+        self.max_backoff = 3600  # Upper bound on the retry delay after repeated failures
+        self.upload_status_budget = 150  # Seconds to wait for an uploaded container to finish processing
+        self._stop_event: Optional[asyncio.Event] = None  # Created in run() on the running loop
+        
+        # Graph API session, shared by every request so connections are pooled and kept alive
+        self._session: Optional[aiohttp.ClientSession] = None
+        
+        # Blocking FTP work gets its own small pool so it can't starve the default executor;
+        # created on first use and dropped in stop(), so the client can be run again
+        self._executor: Optional[ThreadPoolExecutor] = None
     
     async def run(self, instagram_token: str = None):
         """Run the Instagram client with the provided token"""
@@ -134,21 +125,61 @@ class InstagramAgentClient:
             
             # Run the client
             self.is_running = True
+            self._stop_event = asyncio.Event()
             logger.info(f"Instagram client for {self.agent.name} started")
             
             # Main loop for Instagram operations
+            consecutive_failures = 0
             while self.is_running:
-                # Check for scheduled posts, mentions, or DMs
-                # Process with self.agent directly (no lookup needed)
-                await self._check_instagram_activities()
+                delay = self.polling_interval
+                try:
+                    # Check for scheduled posts, mentions, or DMs
+                    # Process with self.agent directly (no lookup needed)
+                    await self._check_instagram_activities()
+                    consecutive_failures = 0
+                except Exception as e:
+                    # Back off exponentially so a failing endpoint isn't hammered
+                    consecutive_failures += 1
+                    delay = min(self.polling_interval * 2 ** consecutive_failures, self.max_backoff)
+                    logger.error(f"Error checking Instagram activities for {self.agent.name} (retrying in {delay}s): {e}")
                 
-                # Respect API rate limits
-                await asyncio.sleep(60)  # Sleep to avoid hitting rate limits
+                # Wait out the interval (respects API rate limits), waking immediately on stop()
+                try:
+                    await asyncio.wait_for(self._stop_event.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
                 
         except Exception as e:
             logger.error(f"Instagram client error for {self.agent.name}: {e}")
             self.is_running = False
     
+    async def stop(self):
+        """Stop the client loop without waiting for the current polling interval to elapse"""
+        self.is_running = False
+        if self._stop_event is not None:
+            self._stop_event.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._executor = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        logger.info(f"Instagram client for {self.agent.name} stopped")
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Return the shared Graph API session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=64, keepalive_timeout=75, ttl_dns_cache=300)
+            )
+        return self._session
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Return the FTP worker pool, creating it on first use"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="instagram")
+        return self._executor
+    
     def _setup_credentials(self, instagram_token: str):
         """Set up Instagram API credentials"""
         # Implementation of _setup_credentials method
@@ -178,21 +209,11 @@ class InstagramAgentClient:
             return False
             
         try:
-            # Connect to the FTP server
-            ftp = FTP(self.ftp_credentials["host"])
-            ftp.login(user=self.ftp_credentials["user"], passwd=self.ftp_credentials["password"])
-            
-            # Upload to this directory
-            remote_dir = self.ftp_credentials["directory"]
-            logger.info(f"Uploading file to {self.ftp_credentials['host']}{remote_dir}")
-            ftp.cwd(remote_dir)
+            logger.info(f"Uploading file to {self.ftp_credentials['host']}{self.ftp_credentials['directory']}")
             
-            # Open the file in binary mode and upload it
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(None, lambda: self._upload_file(ftp, file_path))
-            
-            # Close the FTP connection
-            ftp.quit()
+            # The whole FTP session (connect, login, transfer, quit) blocks, so run it off the event loop
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._get_executor(), self._upload_file, file_path)
             
             # Return the URL of the uploaded file
             file_name = os.path.basename(file_path)
@@ -203,11 +224,24 @@ class InstagramAgentClient:
             logger.error(f"Error uploading file to FTP: {e}")
             return None
 
-    def _upload_file(self, ftp, file_path):
+    def _upload_file(self, file_path):
         """Helper method to upload file to FTP (runs in executor)"""
-        with open(file_path, 'rb') as file:
-            file_name = os.path.basename(file_path)
-            ftp.storbinary(f'STOR {file_name}', file)
+        # Connect to the FTP server and change to the upload directory
+        ftp = FTP(self.ftp_credentials["host"])
+        try:
+            ftp.login(user=self.ftp_credentials["user"], passwd=self.ftp_credentials["password"])
+            ftp.cwd(self.ftp_credentials["directory"])
+            
+            # Open the file in binary mode and upload it
+            with open(file_path, 'rb') as file:
+                file_name = os.path.basename(file_path)
+                ftp.storbinary(f'STOR {file_name}', file)
+            
+            # Close the FTP connection
+            ftp.quit()
+        except Exception:
+            ftp.close()
+            raise
     
     async def post_media(self, file_url, caption=''):
         """Post media (image or video) to Instagram"""
@@ -219,21 +253,22 @@ class InstagramAgentClient:
                 'caption': caption
             }
             
-            if file_url.endswith('.jpg') or file_url.endswith('.jpeg') or file_url.endswith('.png'):
+            url_lower = file_url.lower()
+            if url_lower.endswith(IMAGE_EXTENSIONS):
                 logger.info("Posting image...")
                 param['image_url'] = file_url
-            elif file_url.endswith('.mp4'):
+            elif url_lower.endswith(VIDEO_EXTENSIONS):
                 logger.info("Posting video...")
                 param['media_type'] = 'REELS'
                 param['video_url'] = file_url
                 param['share_to_feed'] = 'true'
             
             # Make the API request
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, params=param) as response:
-                    result = await response.json()
-                    logger.info(f"Media posted with result: {result}")
-                    return result
+            session = self._get_session()
+            async with session.post(url, params=param) as response:
+                result = await response.json()
+                logger.info(f"Media posted with result: {result}")
+                return result
         except Exception as e:
             logger.error(f"Error posting media to Instagram: {e}")
             return None
@@ -251,11 +286,11 @@ class InstagramAgentClient:
             }
             
             # Make the API request
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, params=param) as response:
-                    result = await response.json()
-                    logger.info(f"Reel posted with result: {result}")
-                    return result
+            session = self._get_session()
+            async with session.post(url, params=param) as response:
+                result = await response.json()
+                logger.info(f"Reel posted with result: {result}")
+                return result
         except Exception as e:
             logger.error(f"Error posting reel to Instagram: {e}")
             return None
@@ -271,11 +306,11 @@ class InstagramAgentClient:
             }
             
             # Make the API request
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=param) as response:
-                    result = await response.json()
-                    logger.info(f"Upload status: {result}")
-                    return result
+            session = self._get_session()
+            async with session.get(url, params=param) as response:
+                result = await response.json()
+                logger.info(f"Upload status: {result}")
+                return result
         except Exception as e:
             logger.error(f"Error checking upload status: {e}")
             return None
@@ -291,11 +326,11 @@ class InstagramAgentClient:
             }
             
             # Make the API request
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, params=param) as response:
-                    result = await response.json()
-                    logger.info(f"Container published with result: {result}")
-                    return result
+            session = self._get_session()
+            async with session.post(url, params=param) as response:
+                result = await response.json()
+                logger.info(f"Container published with result: {result}")
+                return result
         except Exception as e:
             logger.error(f"Error publishing container: {e}")
             return None
@@ -313,10 +348,12 @@ class InstagramAgentClient:
             container_id = response['id']
             logger.info(f"Uploaded media with container_id: {container_id}")
             
-            # Check status until ready or timeout
+            # Check status until ready or timeout, polling quickly at first and backing off
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.upload_status_budget
+            delay = 1.0
             upload_complete = False
-            counter = 0
-            while not upload_complete and counter < 25:  # stop after ~2min
+            while not upload_complete and loop.time() < deadline:
                 # Check status of uploaded container
                 response = await self.status_of_upload(container_id)
                 
@@ -329,9 +366,11 @@ class InstagramAgentClient:
                     upload_complete = True
                 else:
                     logger.info(f'Upload not ready. Status: {response.get("status_code", "Unknown")}, {response.get("status", "Unknown")}')
-                    logger.info('Waiting 5 seconds...')
-                    counter += 1
-                    await asyncio.sleep(5)
+                    # Jitter keeps concurrent uploads from polling in lockstep
+                    wait = delay + random.uniform(0, delay * 0.25)
+                    logger.info(f'Waiting {wait:.1f} seconds...')
+                    await asyncio.sleep(wait)
+                    delay = min(delay * 1.7, 15.0)
             
             if upload_complete:
                 # Publish the container
@@ -359,13 +398,13 @@ class InstagramAgentClient:
             logger.info(f"Params: {param}")
             
             # Make the API request
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=param) as response:
-                    result = await response.json()
-                    if 'data' in result and len(result['data']) > 0:
-                        quota_usage = result['data'][0].get('quota_usage', 'Unknown')
-                        logger.info(f"Instagram daily quota usage: {quota_usage}")
-                    return result
+            session = self._get_session()
+            async with session.get(url, params=param) as response:
+                result = await response.json()
+                if 'data' in result and len(result['data']) > 0:
+                    quota_usage = result['data'][0].get('quota_usage', 'Unknown')
+                    logger.info(f"Instagram daily quota usage: {quota_usage}")
+                return result
         except Exception as e:
             logger.error(f"Error getting publishing limit: {e}")
             return None
@@ -400,11 +439,11 @@ class InstagramAgentClient:
             logger.info(f"Params: {params}")
             
             # Make the API request
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params) as response:
-                    result = await response.json()
-                    logger.info(f"Retrieved media data: {result}")
-                    return result
+            session = self._get_session()
+            async with session.get(url, params=params) as response:
+                result = await response.json()
+                logger.info(f"Retrieved media data: {result}")
+                return result
         except Exception as e:
             logger.error(f"Error retrieving user media: {e}")
             return None
@@ -2,35 +2,78 @@
 Extensions for the Agent class from the OpenAI Agents SDK.
 """
 
-from typing import List, Dict, Any, Optional
+import hashlib
+import sys
+from collections import deque
+from typing import Deque, List, Dict, Any, Optional, Tuple
 from dataclasses import dataclass, field
 
 from src.agents import Agent
 from src.agents.mcp import MCPServer # Import MCPServer for type hinting
 
 
-@dataclass
+# Number of recent messages kept in AgentMemory.conversation_history (6 user/assistant pairs)
+CONVERSATION_HISTORY_LIMIT = 12
+
+# slots=True drops the per-instance __dict__; the flag only exists on Python 3.10+
+_DATACLASS_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**_DATACLASS_SLOTS)
 class AgentMemory:
     """
     Maintains the agent's memory between interactions.
+
+    conversation_history is a sliding window: once it holds CONVERSATION_HISTORY_LIMIT
+    messages, each append evicts the oldest one. Long-lived facts belong in user_info,
+    keyed by user ID so one user's facts are never surfaced to another.
     """
-    conversation_history: List[Dict[str, Any]] = field(default_factory=list)
+    conversation_history: Deque[Dict[str, Any]] = field(
+        default_factory=lambda: deque(maxlen=CONVERSATION_HISTORY_LIMIT)
+    )
     user_info: Dict[str, Any] = field(default_factory=dict)
     last_topics: List[str] = field(default_factory=list)
     client: str = "generic"  # Track which client the conversation is from
 
+    def pack(self) -> Tuple[str, str]:
+        """
+        Render the memory as deterministic text plus a short content hash (version).
+
+        Messages keep their insertion order, which is already chronological, and user_info
+        is sorted by key, so identical memory always yields identical bytes and version.
+        """
+        lines = [f"[{m.get('role', '')}] {m.get('content', '')}" for m in self.conversation_history]
+        lines.extend(f"[user_info] {key}: {self.user_info[key]}" for key in sorted(self.user_info, key=str))
+        text = "\n".join(lines)
+        version = hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+        return text, version
+
+
+@dataclass(**_DATACLASS_SLOTS)
+class MessageContext:
+    """
+    Run context for replying to one incoming message: the shared memory plus the
+    user, room and client it came from, so tools can scope what they read from memory.
+    """
+    memory: AgentMemory
+    user_id: str
+    room_id: str
+    client: str = "generic"
+
 
 class CarrierAgent(Agent):
     """
     Extended Agent class with Carrier-specific functionality, including memory and tool tracking.
     """
     all_tool_descriptions: Dict[str, str] # Added attribute to store combined tool descriptions
+    client_contexts: Dict[str, str] # Client name -> client-specific system message, kept out of the static instructions
 
     def __init__(self, *args, **kwargs):
         # Extract memory parameter before passing to parent
         self.memory = kwargs.pop('memory', None)
         # Initialize the new attribute before calling super().__init__
         self.all_tool_descriptions = {} # Initialize as empty dict
+        self.client_contexts = {}
         super().__init__(*args, **kwargs)
         # Note: all_tool_descriptions will be populated later in run_agents.py after initialization
 
@@ -72,5 +115,7 @@ class CarrierAgent(Agent):
         # Ensure we copy any additional attributes that might have been set
         if hasattr(agent, 'all_tool_descriptions'):
             carrier_agent.all_tool_descriptions = agent.all_tool_descriptions
+        if hasattr(agent, 'client_contexts'):
+            carrier_agent.client_contexts = agent.client_contexts
         
         return carrier_agent
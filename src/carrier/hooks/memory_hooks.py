@@ -2,56 +2,91 @@
 Hooks for integrating memory system with agent runtime.
 """
 
-from typing import Any, Optional, Dict, List
+from typing import Any, Optional, Dict, List, Sequence
+from datetime import datetime, timezone
 import logging
 
 from agents import RunContextWrapper, RunHooks, Agent
 
 from ..extensions.carrier_agent import AgentMemory
 
+logger = logging.getLogger(__name__)
+
+
+def history_to_input_items(
+    history: Sequence[Dict[str, Any]],
+    limit: int = 10,
+    room_id: Optional[str] = None
+) -> List[Dict[str, str]]:
+    """Convert the most recent conversation history entries into Runner input items.
+
+    Prior turns are passed as run input rather than appended to the agent's instructions,
+    which keeps the instructions byte-identical between runs so provider prompt caches hit.
+
+    Args:
+        history: Conversation history entries with 'role' and 'content' keys
+        limit: Maximum number of recent messages to include
+        room_id: If given, only replay messages recorded in this room/channel
+
+    Returns:
+        List of {"role", "content"} message items, oldest first
+    """
+    items = []
+    # Walk newest first and stop once `limit` messages from the room have been collected
+    for message in reversed(history):
+        if len(items) >= limit:
+            break
+        if room_id is not None and message.get('room_id') != room_id:
+            continue
+        role = message.get('role', '')
+        content = message.get('content', '')
+        # Only replay chat turns that have both role and content
+        if role in ("user", "assistant") and content:
+            items.append({"role": role, "content": content})
+    items.reverse()
+    return items
+
 
 class MemoryContextHooks(RunHooks):
-    """Hooks that add conversation history from memory system to agent context."""
+    """Hooks that record an agent run's reply in memory, tagged with its user and room.
 
-    def __init__(self, user_id: str, room_id: str, conversation_limit: int = 10, client_name: str = "generic"):
+    Conversation history itself is supplied through the run input (see
+    history_to_input_items), filtered to the same room, rather than injected into the
+    agent's instructions.
+    """
+
+    def __init__(self, user_id: str, room_id: str, client_name: str = "generic"):
         """Initialize with user and room IDs.
 
         Args:
-            user_id: User ID for retrieving conversation history
-            room_id: Room/conversation ID for retrieving conversation history
-            conversation_limit: Maximum number of messages to retrieve
+            user_id: ID of the user the agent is replying to
+            room_id: Room/conversation ID the reply belongs to
             client_name: Name of the client (discord, instagram, etc.)
         """
         self.user_id = user_id
         self.room_id = room_id
-        self.conversation_limit = conversation_limit
-        self.conversation_added = False
-        self.client_name = client_name
-
-    async def on_agent_start(self, context: RunContextWrapper, agent: Agent) -> None:
-        """Called when agent processing begins - add conversation history to system prompt."""
-        # Skip if memory has already been added to avoid adding it multiple times in a single run
-        if self.conversation_added:
-            return
+        self.client_name = client_name.lower()
 
-        # Only process if context contains a memory object
+    async def on_agent_end(self, context: RunContextWrapper, agent: Agent, output: Any) -> None:
+        """Store the agent's reply in memory so later turns in the same room can see it."""
         memory = self._get_memory_from_context(context)
-        if not memory:
-            return
 
-        # Add conversation history to system prompt
-        if hasattr(memory, 'conversation_history') and memory.conversation_history:
-            # Format the conversation history for context
-            formatted_history = self.format_conversation_for_context(memory.conversation_history)
-            
-            # Only add if there's actual content
-            if formatted_history:
-                # Add to system prompt
-                system_prompt = agent.instructions + "\n\n## Recent Conversation History\n" + formatted_history
-                agent.instructions = system_prompt
-                
-                # Mark as added to avoid adding it again in the same run
-                self.conversation_added = True
+        # Final output is usually a str
+        content = output if isinstance(output, str) else getattr(output, 'content', None)
+        if memory and content:
+            memory.conversation_history.append({
+                "role": "assistant",
+                "content": content,
+                "timestamp": str(datetime.now(timezone.utc)),
+                "client": self.client_name,
+                "user_id": self.user_id,
+                "room_id": self.room_id
+            })
+            # pack() hashes the whole memory, so only pay for it when the line is emitted
+            if logger.isEnabledFor(logging.INFO):
+                _, memory_version = memory.pack()
+                logger.info("[%s] Memory contains %d messages (version %s)",
+                            self.client_name, len(memory.conversation_history), memory_version)
 
     def _get_memory_from_context(self, context: RunContextWrapper) -> Optional[AgentMemory]:
         """Get memory object from context if available."""
@@ -67,30 +102,3 @@ class MemoryContextHooks(RunHooks):
             return context.context.memory
             
         return None
-
-    def format_conversation_for_context(self, history: List[Dict[str, Any]]) -> str:
-        """Format conversation history for inclusion in system prompt."""
-        if not history:
-            return ""
-            
-        # Limit to most recent messages
-        recent_history = history[-self.conversation_limit:]
-        
-        # Format each message
-        formatted_messages = []
-        for message in recent_history:
-            role = message.get('role', '')
-            content = message.get('content', '')
-            timestamp = message.get('timestamp', '')
-            
-            # Only add if we have both role and content
-            if role and content:
-                formatted_messages.append(f"{role.capitalize()}: {content}")
-                
-        # Join with line breaks
-        return "\n".join(formatted_messages)
-
-    async def on_agent_end(self, context: RunContextWrapper, agent: Agent, output: Any) -> None:
-        """Called when agent processing completes."""
-        # Reset conversation_added flag at the end of the run
-        self.conversation_added = False
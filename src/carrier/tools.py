@@ -1,20 +1,72 @@
 from typing import Optional, Dict, List, Tuple, Any
-from agents import Tool, function_tool
-from src.agents.run_context import RunContextWrapper
+# RunContextWrapper must come from the same `agents` package as function_tool,
+# otherwise the context parameter is not recognised and ends up in the tool schema
+from agents import RunContextWrapper, Tool, function_tool
 import aiohttp
 import base64
+import json
 import logging
 import inspect
+import functools
+import time
+
+try:
+    import orjson  # Optional: faster JSON for the image API request/response
+except ImportError:
+    orjson = None
+
+try:
+    import pybase64  # Optional: SIMD-accelerated base64 decoding for image payloads
+except ImportError:
+    pybase64 = None
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 # Import the CarrierAgent at the module level but AFTER other imports
 # to avoid circular imports during initial loading
-from src.carrier.extensions.carrier_agent import CarrierAgent
+from src.carrier.extensions.carrier_agent import CarrierAgent, MessageContext
+
+# Shared HTTP session for tool calls, created on first use so keep-alive connections
+# are reused across calls instead of paying a new connect/handshake every time
+_http_session: Optional[aiohttp.ClientSession] = None
+
+# Upper bound for a whole tool request (connect + generation + body read)
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=60)
+
+def _get_http_session() -> aiohttp.ClientSession:
+    """Return the shared HTTP session, creating it if needed (must be called from a running loop)."""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            # SSL verification is disabled for the local image generation API
+            # The image service is a single local host: keep the small connection cap (it can only
+            # generate so many images at once) but cache its DNS entry instead of re-resolving every 10s
+            connector=aiohttp.TCPConnector(ssl=False, limit=8, keepalive_timeout=60, ttl_dns_cache=300),
+            timeout=HTTP_TIMEOUT,
+            # The tool APIs are stateless, so don't parse and store cookies on every response
+            cookie_jar=aiohttp.DummyCookieJar(),
+        )
+    return _http_session
+
+async def close_http_session() -> None:
+    """Close the shared HTTP session used by the tools. Call once on shutdown."""
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
 
 # --- Tool Definitions ---
 
+# Weather results are reused for this many seconds per location
+WEATHER_CACHE_TTL = 600
+
+@functools.lru_cache(maxsize=512)
+def _lookup_weather(location: str, ttl_bucket: int) -> str:
+    """Resolve the weather for a normalized location; ttl_bucket expires entries after WEATHER_CACHE_TTL."""
+    # This is a simple implementation that always returns "sunny"
+    return "sunny"
+
 @function_tool()
 async def GET_WEATHER(location: str) -> str:
     """
@@ -26,13 +78,66 @@ async def GET_WEATHER(location: str) -> str:
     Returns:
         A string describing the weather
     """
-    # This is a simple implementation that always returns "sunny"
     # Handle default case inside the function instead of in the parameter
     if not location or location.lower() == "default":
         location = "default location"
 
     logger.info(f"Weather tool called for location: {location}")
-    return "sunny"
+    # Normalize so "Paris", " paris " and "PARIS" share one cache entry
+    normalized = location.strip().lower()
+    return _lookup_weather(normalized, int(time.monotonic() // WEATHER_CACHE_TTL))
+
+# Maximum number of entries of each kind returned by RECALL
+RECALL_LIMIT = 5
+
+@function_tool()
+async def RECALL(ctx: RunContextWrapper[Any], query: str) -> str:
+    """
+    Search your memory of recent messages in this conversation and known facts about the user.
+    Use this instead of guessing when you need something said earlier.
+
+    Args:
+        query: Text to look for in past messages and stored user info
+
+    Returns:
+        A JSON object with the most recent matching messages and user info entries
+    """
+    # Only a per-message context says which room and user this run belongs to; without
+    # it any match could come from another channel, DM or client, so return nothing
+    context = ctx.context
+    if not isinstance(context, MessageContext):
+        return "No memory is available."
+    memory = context.memory
+
+    needle = (query or "").strip().lower()
+    logger.info(f"Recall tool called with query: {needle}")
+    if not needle:
+        return "No query given."
+
+    # Simple substring match for now, newest messages first, limited to the current
+    # room the same way history_to_input_items replays it
+    messages = []
+    for message in reversed(memory.conversation_history):
+        if message.get("room_id") != context.room_id:
+            continue
+        content = str(message.get("content", ""))
+        if needle in content.lower():
+            messages.append({"role": message.get("role", ""), "content": content})
+            if len(messages) >= RECALL_LIMIT:
+                break
+
+    # Only facts stored for the user who sent this message
+    user_info = {}
+    for key, value in (memory.user_info.get(context.user_id) or {}).items():
+        if needle in str(key).lower() or needle in str(value).lower():
+            user_info[key] = value
+            if len(user_info) >= RECALL_LIMIT:
+                break
+
+    result = {"messages": messages, "user_info": user_info}
+    if orjson is not None:
+        return orjson.dumps(result, default=str, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(result, default=str)
 
 @function_tool()
 async def generate_image(description: str) -> Optional[bytes]:
@@ -46,31 +151,39 @@ async def generate_image(description: str) -> Optional[bytes]:
         Bytes of the generated image, or None if generation failed
     """
     try:
-        # Use aiohttp to make an async HTTP request
-        async with aiohttp.ClientSession() as session:
-            payload = {"image_description": description}
-            headers = {"Content-Type": "application/json"}
-
-            # Make the request to the local image generation API
-            async with session.post(
-                "https://localhost:9080",
-                json=payload,
-                headers=headers,
-                ssl=False  # Disable SSL verification for local development
-            ) as response:
-                if response.status != 200:
-                    logger.error(f"Image generation API returned status {response.status}")
-                    return None
-
-                # Parse the response JSON to get the base64 image data
-                response_data = await response.json()
-                if not response_data or "base64_image" not in response_data:
-                    logger.error("No base64 image data in response")
-                    return None
-
-                # Decode the base64 string to bytes
-                image_bytes = base64.b64decode(response_data["base64_image"])
-                return image_bytes
+        # Use the shared aiohttp session so connections are kept alive between calls
+        session = _get_http_session()
+        body = {"image_description": description}
+        # Serialize to bytes ourselves so orjson is used when available
+        payload = orjson.dumps(body) if orjson is not None else json.dumps(body).encode("utf-8")
+        # Prefer raw image bytes; the JSON/base64 envelope is still accepted
+        headers = {"Content-Type": "application/json", "Accept": "image/*, application/json"}
+
+        # Make the request to the local image generation API
+        async with session.post(
+            "https://localhost:9080",
+            data=payload,
+            headers=headers,
+        ) as response:
+            if response.status != 200:
+                logger.error(f"Image generation API returned status {response.status}")
+                return None
+
+            # A raw image response skips the base64 encode/JSON parse/decode round-trip
+            if response.content_type.startswith("image/"):
+                return await response.read()
+
+            # Parse the response JSON to get the base64 image data
+            raw = await response.read()
+            response_data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+            if not response_data or "base64_image" not in response_data:
+                logger.error("No base64 image data in response")
+                return None
+
+            # Decode the base64 string to bytes
+            b64decode = pybase64.b64decode if pybase64 is not None else base64.b64decode
+            image_bytes = b64decode(response_data["base64_image"])
+            return image_bytes
 
     except Exception as e:
         logger.error(f"Error generating image: {e}")
@@ -107,9 +220,9 @@ class ToolExecutionWrapper:
             # Build the response
             response_lines = ["Here are the tools available to you:"]
             # Sort tools alphabetically for consistent output
-            for tool_name in sorted(tool_descriptions.keys()):
-                description = tool_descriptions[tool_name]
-                response_lines.append(f"- {tool_name.upper()}: {description}")
+            # Names are already uppercased when the descriptions are collected
+            for tool_name, description in sorted(tool_descriptions.items()):
+                response_lines.append(f"- {tool_name}: {description}")
             
             return "\n".join(response_lines)
         except Exception as e:
@@ -119,10 +232,27 @@ class ToolExecutionWrapper:
 # Update TOOL_REGISTRY to use the new implementation
 TOOL_REGISTRY: Dict[str, Tool] = {
     "GET_WEATHER": GET_WEATHER,
+    "RECALL": RECALL,
     "GENERATE_IMAGE": generate_image,
     "LIST_AVAILABLE_TOOLS": ToolExecutionWrapper.list_available_tools,
 }
 
+def _describe_tool(tool: Tool) -> str:
+    """Extract a tool's description from its metadata or docstring."""
+    if hasattr(tool, 'description') and tool.description:
+        return tool.description
+    if hasattr(tool, 'info') and hasattr(tool.info, 'description'):
+        return tool.info.description or "No description available"
+    if tool.__doc__:
+        return " ".join(line.strip() for line in tool.__doc__.split('\n')).strip()
+    return "No description available"
+
+# Descriptions are static, so extract them once at import rather than on every agent init.
+# Registry entries that aren't valid Tool objects have no description and are skipped.
+TOOL_DESCRIPTIONS: Dict[str, str] = {
+    name: _describe_tool(tool) for name, tool in TOOL_REGISTRY.items() if isinstance(tool, Tool)
+}
+
 def get_registered_tools(tool_config: List[str]) -> Tuple[List[Tool], Dict[str, str]]:
     """
     Get tools and their descriptions based on requested tool names.
@@ -136,29 +266,17 @@ def get_registered_tools(tool_config: List[str]) -> Tuple[List[Tool], Dict[str,
     configured_tools: List[Tool] = []
     tool_descriptions: Dict[str, str] = {}
     
-    # Always include LIST_AVAILABLE_TOOLS by default
+    # Always include LIST_AVAILABLE_TOOLS by default (without mutating the caller's list)
     if "LIST_AVAILABLE_TOOLS" not in tool_config:
-        tool_config.append("LIST_AVAILABLE_TOOLS")
+        tool_config = [*tool_config, "LIST_AVAILABLE_TOOLS"]
     
     for tool_name in tool_config:
         tool_name_upper = tool_name.upper()  # Normalize name
         if tool_name_upper in TOOL_REGISTRY:
-            tool = TOOL_REGISTRY[tool_name_upper]
-            # Verify that this is a valid Tool object before adding
-            if isinstance(tool, Tool):
-                configured_tools.append(tool)
-                
-                # Extract description from docstring or tool metadata
-                description = "No description available"
-                if hasattr(tool, 'description') and tool.description:
-                    description = tool.description
-                elif hasattr(tool, 'info') and hasattr(tool.info, 'description'):
-                    description = tool.info.description or description
-                elif tool.__doc__:
-                    doc = tool.__doc__
-                    description = " ".join(line.strip() for line in doc.split('\n')).strip()
-                    
-                tool_descriptions[tool_name_upper] = description
+            # Only valid Tool objects have a precomputed description
+            if tool_name_upper in TOOL_DESCRIPTIONS:
+                configured_tools.append(TOOL_REGISTRY[tool_name_upper])
+                tool_descriptions[tool_name_upper] = TOOL_DESCRIPTIONS[tool_name_upper]
                 logger.debug(f"Registered tool: {tool_name_upper}")
             else:
                 logger.warning(f"Tool '{tool_name_upper}' is not a valid Tool instance and will be skipped.")
@@ -15,7 +15,6 @@ def add_memory_hooks(
     agent: Agent,
     user_id: str,
     room_id: str,
-    conversation_limit: int = 10,
     client_name: str = "generic"
 ) -> RunHooks:
     """
@@ -26,7 +25,6 @@ def add_memory_hooks(
         agent: Agent to use
         user_id: User ID for memory context
         room_id: Room ID for memory context
-        conversation_limit: Maximum number of conversation messages to include
         client_name: Name of the client (discord, instagram, etc.)
         
     Returns:
@@ -36,7 +34,6 @@ def add_memory_hooks(
     memory_hooks = MemoryContextHooks(
         user_id=user_id,
         room_id=room_id,
-        conversation_limit=conversation_limit,
         client_name=client_name
     )
     